@@ -1,135 +1,248 @@
-import json
+import asyncio
+import orjson
+import fastjsonschema
 import time
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from openai import AsyncOpenAI
 import reservation_db as reservation_api
 from logging_config import request_logger
+from config import TOOL_THREADS
+
+# Tool schemas are static, so build them once at import instead of per request
+_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "check_inventory",
+            "description": "Check available table slots for a date within a time range.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date": {"type": "string", "description": "Date in YYYY-MM-DD format"},
+                    "start_time": {"type": "string", "description": "Start time in HH:MM format (24 hour)"},
+                    "end_time": {"type": "string", "description": "End time in HH:MM format (24 hour)"},
+                    "covers": {"type": "integer", "description": "Number of guests"}
+                },
+                "required": ["date", "start_time", "end_time", "covers"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "create_booking",
+            "description": "Create a new table reservation.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "Customer Name"},
+                    "phone": {"type": "string", "description": "Customer Phone Number"},
+                    "email": {"type": "string", "description": "Customer Email"},
+                    "date": {"type": "string", "description": "Date in YYYY-MM-DD format"},
+                    "time": {"type": "string", "description": "Time in HH:MM format"},
+                    "covers": {"type": "integer", "description": "Number of guests"}
+                },
+                "required": ["name", "phone", "email", "date", "time", "covers"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "cancel_booking",
+            "description": "Cancel an existing reservation. Requires both the Booking Reference (BK-...) and the System ID.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "booking_id": {"type": "string", "description": "The Booking Reference ID (e.g., BK-6650f1c2...)"},
+                    "reason": {"type": "string", "description": "Reason for cancellation"}
+                },
+                "required": ["booking_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_booking_status",
+            "description": "Get status of a booking using the Partner Booking ID.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "booking_id": {"type": "string", "description": "The unique booking ID provided during confirmation"}
+                },
+                "required": ["booking_id"]
+            }
+        }
+    }
+]
+
+def _create_booking_reply(result: dict):
+    """Format a confirmed booking directly for WhatsApp"""
+    if result.get("status") != "success":
+        return None
+    return (
+        f"Your table is booked! ✅\n"
+        f"*Booking ID:* {result['booking_id']}\n"
+        f"*Date:* {result['date']} at {result['time']}\n"
+        f"*Guests:* {result['covers']}"
+    )
+
+def _booking_status_reply(result: dict):
+    """Format a found booking's status directly for WhatsApp"""
+    if "error" in result or result.get("status") in ("not_found", "failed") or not result.get("booking_id"):
+        return None
+    lines = [f"Booking *{result['booking_id']}* is *{str(result.get('status', 'unknown')).lower()}*."]
+    if result.get("date"):
+        lines.append(f"*Date:* {result['date']} at {result.get('time')}")
+    if result.get("covers"):
+        lines.append(f"*Guests:* {result['covers']}")
+    return "\n".join(lines)
+
+# Tools whose successful results can be sent to the user as-is, skipping the follow-up LLM call
+_TERMINAL_REPLIES = {
+    "create_booking": _create_booking_reply,
+    "get_booking_status": _booking_status_reply,
+}
+
+# Argument validators generated once from the tool schemas
+_VALIDATORS = {tool["function"]["name"]: fastjsonschema.compile(tool["function"]["parameters"]) for tool in _TOOLS}
+
+# Returned instead of re-running a tool call the model already made with identical arguments
+_REPEATED_CALL_RESULT = {"error": "Repeated call detected; provide final answer."}
 
 class RestaurantAgent:
     """Agent for handling restaurant reservations and inquiries using agentic loop"""
     
-    def __init__(self, cerebras_client: OpenAI, model_id: str):
+    def __init__(self, cerebras_client: AsyncOpenAI, model_id: str):
         self.client = cerebras_client
         self.model_id = model_id
         self.logger = request_logger
         self.max_iterations = 5
+        # Reservation tools use blocking pymongo calls, so they run on threads off the event loop
+        self._pool = ThreadPoolExecutor(max_workers=TOOL_THREADS)
+        self._dispatch = {
+            "check_inventory": lambda a: reservation_api.get_inventory(a["date"], a["start_time"], a["end_time"], a["covers"]),
+            "create_booking": lambda a: reservation_api.create_booking(
+                a["name"], a["phone"], a["email"],
+                a["date"], a["time"], a["covers"]
+            ),
+            "cancel_booking": lambda a: reservation_api.cancel_booking(a["booking_id"], a.get("reason", "User request")),
+            "get_booking_status": lambda a: reservation_api.get_booking_status(a["booking_id"]),
+        }
     
-    def define_tools(self):
-        """Define tools available to the agent"""
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "check_inventory",
-                    "description": "Check available table slots for a date within a time range.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "date": {"type": "string", "description": "Date in YYYY-MM-DD format"},
-                            "start_time": {"type": "string", "description": "Start time in HH:MM format (24 hour)"},
-                            "end_time": {"type": "string", "description": "End time in HH:MM format (24 hour)"},
-                            "covers": {"type": "integer", "description": "Number of guests"}
-                        },
-                        "required": ["date", "start_time", "end_time", "covers"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "create_booking",
-                    "description": "Create a new table reservation.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "name": {"type": "string", "description": "Customer Name"},
-                            "phone": {"type": "string", "description": "Customer Phone Number"},
-                            "email": {"type": "string", "description": "Customer Email"},
-                            "date": {"type": "string", "description": "Date in YYYY-MM-DD format"},
-                            "time": {"type": "string", "description": "Time in HH:MM format"},
-                            "covers": {"type": "integer", "description": "Number of guests"}
-                        },
-                        "required": ["name", "phone", "email", "date", "time", "covers"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "cancel_booking",
-                    "description": "Cancel an existing reservation. Requires both the Booking Reference (BK-...) and the System ID.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "booking_id": {"type": "string", "description": "The Booking Reference ID (e.g., BK-174...)"},
-                            "reason": {"type": "string", "description": "Reason for cancellation"}
-                        },
-                        "required": ["booking_id"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_booking_status",
-                    "description": "Get status of a booking using the Partner Booking ID.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "booking_id": {"type": "string", "description": "The unique booking ID provided during confirmation"}
-                        },
-                        "required": ["booking_id"]
-                    }
-                }
-            }
-        ]
+    async def _run_blocking(self, func, *args):
+        """Run a blocking reservation API call on the tool thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, func, *args)
     
-    def execute_tool_call(self, tool_call):
+    async def execute_tool_call(self, tool_call):
         """Execute the requested tool"""
         try:
             func_name = tool_call.function.name
-            args = json.loads(tool_call.function.arguments)
-            self.logger.info(f"Executing tool: {func_name} with args: {args}")
+            args = orjson.loads(tool_call.function.arguments)
+            if self.logger.is_enabled():
+                self.logger.info(f"Executing tool: {func_name} with args: {args}")
 
-            if func_name == "check_inventory":
-                return reservation_api.get_inventory(args["date"], args["start_time"], args["end_time"], args["covers"])
-            elif func_name == "create_booking":
-                return reservation_api.create_booking(
-                    args["name"], args["phone"], args["email"], 
-                    args["date"], args["time"], args["covers"]
-                )
-            elif func_name == "cancel_booking":
-                return reservation_api.cancel_booking(
-                    args["booking_id"], args.get("reason", "User request")
-                )
-            elif func_name == "get_booking_status":
-                return reservation_api.get_booking_status(args["booking_id"])
-            
-            return {"error": "Unknown function"}
+            handler = self._dispatch.get(func_name)
+            if handler is None:
+                return {"error": "Unknown function"}
+            
+            # Reject malformed arguments up front with a message the LLM can act on
+            try:
+                _VALIDATORS[func_name](args)
+            except fastjsonschema.JsonSchemaValueException as e:
+                self.logger.warning(f"Invalid arguments for {func_name}: {e.message}")
+                return {"error": f"Invalid arguments for {func_name}: {e.message}"}
+            
+            return await self._run_blocking(handler, args)
         except Exception as e:
             self.logger.error(f"Tool execution failed: {e}")
             return {"error": str(e)}
     
-    def process_message(self, system_prompt: str, conversation_history: list, message_id: str, user_id: str, restaurant_id: str) -> str:
+    async def _timed_tool_call(self, tool_call):
+        """Execute a tool call and return its result with the elapsed time"""
+        tool_start = time.perf_counter()
+        tool_result = await self.execute_tool_call(tool_call)
+        return tool_result, time.perf_counter() - tool_start
+    
+    def _build_messages(self, system_prompt: str, conversation_history: list, current_time: str) -> list:
+        """Build messages list: static system prompt + current time + conversation history"""
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Current IST: {current_time}"}
+        ]
+        messages.extend(conversation_history)
+        return messages
+    
+    def _terminal_reply(self, tool_calls: list, tool_results: list):
+        """Return a ready-made reply when a single deterministic tool call fully answers the user"""
+        if len(tool_calls) != 1 or not isinstance(tool_results[0], dict):
+            return None
+        formatter = _TERMINAL_REPLIES.get(tool_calls[0].function.name)
+        return formatter(tool_results[0]) if formatter else None
+    
+    async def _repeated_tool_call(self):
+        """Stand-in result for a tool call already made with identical arguments"""
+        return _REPEATED_CALL_RESULT, 0.0
+    
+    async def _execute_tool_calls(self, messages: list, tool_calls: list, seen_calls: set, message_id: str, iteration: int, user_id: str, restaurant_id: str) -> list:
+        """
+        Execute tool calls concurrently, append results to messages in original order and return them.
+        
+        Calls whose (name, arguments) are already in seen_calls are not re-run; they get
+        _REPEATED_CALL_RESULT so the model stops looping on them.
+        """
+        tool_count = len(tool_calls)
+        pending = []
+        for idx, tool_call in enumerate(tool_calls, 1):
+            call_key = (tool_call.function.name, tool_call.function.arguments)
+            if call_key in seen_calls:
+                self.logger.warning(message_id, f"[REPEATED_TOOL_CALL] Tool {idx}/{tool_count} | Name: {tool_call.function.name} | Iteration: {iteration} | User: {user_id} | Restaurant: {restaurant_id}")
+                pending.append(self._repeated_tool_call())
+                continue
+            seen_calls.add(call_key)
+            self.logger.info(message_id, f"[TOOL_EXECUTION_START] Tool {idx}/{tool_count} | Name: {tool_call.function.name} | Iteration: {iteration} | User: {user_id} | Restaurant: {restaurant_id}")
+            pending.append(self._timed_tool_call(tool_call))
+        
+        timed_results = await asyncio.gather(*pending)
+        
+        for idx, (tool_call, (tool_result, tool_time)) in enumerate(zip(tool_calls, timed_results), 1):
+            # The OpenAI messages payload needs str content
+            result_str = orjson.dumps(tool_result).decode()
+            if self.logger.is_enabled():
+                self.logger.info(message_id, f"[TOOL_EXECUTION_COMPLETE] Tool {idx} - Time: {tool_time:.4f}s | Result: {result_str}{'...' if len(result_str) > 100 else ''}")
+            
+            # Append tool result to conversation
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": result_str
+            })
+        
+        return [tool_result for tool_result, _ in timed_results]
+    
+    async def process_message(self, system_prompt: str, conversation_history: list, message_id: str, user_id: str, restaurant_id: str, current_time: str) -> str:
         """
         Process a message through the agentic loop.
         
         Args:
-            system_prompt: System prompt for the LLM
+            system_prompt: Static system prompt for the LLM (kept byte-identical across requests for prompt caching)
             conversation_history: List of message dicts with role and content
             message_id: Message ID for logging
             user_id: User ID for logging
             restaurant_id: Restaurant ID for logging
+            current_time: Current IST time, sent after the system prompt so the cacheable prefix stays stable
         
         Returns:
             Final response string from the agent
         """
-        tools = self.define_tools()
         llm_call_count = 0
+        seen_calls = set()
+        tool_choice = "auto"
         final_reply = ""
-        
-        # Build messages list: system prompt + conversation history
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(conversation_history)
+        messages = self._build_messages(system_prompt, conversation_history, current_time)
         
         # Agentic loop
         while llm_call_count < self.max_iterations:
@@ -137,11 +250,11 @@ class RestaurantAgent:
             llm_call_start = time.time()
             self.logger.info(message_id, f"[LLM_CALL_START] Call {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id} | Model: {self.model_id}")
             
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model_id,
                 messages=messages,
-                tools=tools,
-                tool_choice="auto",
+                tools=_TOOLS,
+                tool_choice=tool_choice,
                 temperature=0.0
             )
             
@@ -161,32 +274,131 @@ class RestaurantAgent:
             
             # Append assistant message with tool calls to conversation
             messages.append(assistant_msg)
+            tool_results = await self._execute_tool_calls(messages, assistant_msg.tool_calls, seen_calls, message_id, llm_call_count, user_id, restaurant_id)
             
-            # Execute each tool call
-            for idx, tool_call in enumerate(assistant_msg.tool_calls, 1):
-                tool_start = time.time()
-                self.logger.info(message_id, f"[TOOL_EXECUTION_START] Tool {idx}/{len(assistant_msg.tool_calls)} | Name: {tool_call.function.name} | Iteration: {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id}")
-                
-                tool_result = self.execute_tool_call(tool_call)
-                
-                tool_time = time.time() - tool_start
-                result_str = json.dumps(tool_result)
-                self.logger.info(message_id, f"[TOOL_EXECUTION_COMPLETE] Tool {idx} - Time: {tool_time:.4f}s | Result: {result_str}{'...' if len(result_str) > 100 else ''}")
-                
-                # Append tool result to conversation
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "content": result_str
-                })
+            terminal_reply = self._terminal_reply(assistant_msg.tool_calls, tool_results)
+            if terminal_reply:
+                self.logger.info(message_id, f"[TERMINAL_TOOL_REPLY] Skipping follow-up LLM call at iteration {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id}")
+                final_reply = terminal_reply
+                break
+            
+            # A stuck model repeating itself must answer on the next call instead of looping
+            if any(result is _REPEATED_CALL_RESULT for result in tool_results):
+                tool_choice = "none"
             
             # Loop will continue to next iteration to process tool results
-        
-        if llm_call_count >= self.max_iterations:
+        else:
+            # Loop exhausted without a final reply
             self.logger.warning(message_id, f"[MAX_ITERATIONS_REACHED] Stopping at {self.max_iterations} iterations | User: {user_id} | Restaurant: {restaurant_id}")
             final_reply = "I'm taking too long to process this. Please try again."
         
-        self.logger.info(message_id, f"[FINAL_REPLY] Content: {final_reply}")
-        self.logger.info(message_id, f"[AGENT_COMPLETE] Total LLM Calls: {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id}")
+        if self.logger.is_enabled():
+            self.logger.info(message_id, f"[FINAL_REPLY] Content: {final_reply}")
+            self.logger.info(message_id, f"[AGENT_COMPLETE] Total LLM Calls: {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id}")
         
         return final_reply
+    
+    async def process_message_stream(self, system_prompt: str, conversation_history: list, message_id: str, user_id: str, restaurant_id: str, current_time: str):
+        """
+        Process a message through the agentic loop, streaming the final reply.
+        
+        Same arguments as process_message. Yields (event, text) pairs:
+        - ("delta", chunk): reply text as the model decodes it
+        - ("retract", ""): the text streamed this turn preceded a tool call and is not the reply
+        - ("final", reply): the complete final reply, always last
+        Turns that emit tool calls are accumulated from the stream and executed before the
+        next LLM call.
+        """
+        llm_call_count = 0
+        seen_calls = set()
+        tool_choice = "auto"
+        final_reply = ""
+        messages = self._build_messages(system_prompt, conversation_history, current_time)
+        
+        # Agentic loop
+        while llm_call_count < self.max_iterations:
+            llm_call_count += 1
+            llm_call_start = time.time()
+            self.logger.info(message_id, f"[LLM_STREAM_START] Call {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id} | Model: {self.model_id}")
+            
+            stream = await self.client.chat.completions.create(
+                model=self.model_id,
+                messages=messages,
+                tools=_TOOLS,
+                tool_choice=tool_choice,
+                temperature=0.0,
+                stream=True
+            )
+            
+            content_parts = []
+            tool_call_parts = {}
+            streamed = False
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.tool_calls:
+                    for tool_call_delta in delta.tool_calls:
+                        part = tool_call_parts.setdefault(tool_call_delta.index, {"id": "", "name": "", "arguments": ""})
+                        if tool_call_delta.id:
+                            part["id"] = tool_call_delta.id
+                        if tool_call_delta.function:
+                            part["name"] += tool_call_delta.function.name or ""
+                            part["arguments"] += tool_call_delta.function.arguments or ""
+                elif delta.content:
+                    content_parts.append(delta.content)
+                    # Only forward text while this turn still looks like the final reply
+                    if not tool_call_parts:
+                        streamed = True
+                        yield "delta", delta.content
+            
+            llm_call_time = time.time() - llm_call_start
+            self.logger.info(message_id, f"[LLM_STREAM_COMPLETE] Call {llm_call_count} - Time: {llm_call_time:.4f}s | User: {user_id} | Restaurant: {restaurant_id}")
+            
+            # If no tool calls, the streamed content was the final response
+            if not tool_call_parts:
+                self.logger.info(message_id, f"[NO_TOOL_CALLS] Final response at iteration {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id}")
+                final_reply = "".join(content_parts)
+                break
+            
+            self.logger.info(message_id, f"[TOOL_CALLS_DETECTED] Count: {len(tool_call_parts)} | Iteration: {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id}")
+            
+            # Text sent before the tool call was interim chatter; tell the client to discard it
+            if streamed:
+                yield "retract", ""
+            
+            tool_calls = [
+                SimpleNamespace(id=part["id"], function=SimpleNamespace(name=part["name"], arguments=part["arguments"]))
+                for _, part in sorted(tool_call_parts.items())
+            ]
+            messages.append({
+                "role": "assistant",
+                "content": "".join(content_parts) or None,
+                "tool_calls": [
+                    {"id": tc.id, "type": "function", "function": {"name": tc.function.name, "arguments": tc.function.arguments}}
+                    for tc in tool_calls
+                ]
+            })
+            tool_results = await self._execute_tool_calls(messages, tool_calls, seen_calls, message_id, llm_call_count, user_id, restaurant_id)
+            
+            terminal_reply = self._terminal_reply(tool_calls, tool_results)
+            if terminal_reply:
+                self.logger.info(message_id, f"[TERMINAL_TOOL_REPLY] Skipping follow-up LLM call at iteration {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id}")
+                final_reply = terminal_reply
+                yield "delta", final_reply
+                break
+            
+            # A stuck model repeating itself must answer on the next call instead of looping
+            if any(result is _REPEATED_CALL_RESULT for result in tool_results):
+                tool_choice = "none"
+        else:
+            # Loop exhausted without a final reply
+            self.logger.warning(message_id, f"[MAX_ITERATIONS_REACHED] Stopping at {self.max_iterations} iterations | User: {user_id} | Restaurant: {restaurant_id}")
+            final_reply = "I'm taking too long to process this. Please try again."
+            yield "delta", final_reply
+        
+        if self.logger.is_enabled():
+            self.logger.info(message_id, f"[FINAL_REPLY] Content: {final_reply}")
+            self.logger.info(message_id, f"[AGENT_COMPLETE] Total LLM Calls: {llm_call_count} | User: {user_id} | Restaurant: {restaurant_id}")
+        
+        yield "final", final_reply
@@ -1,10 +1,12 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from openai import OpenAI
-import json
+from pydantic import BaseModel, ConfigDict, Field
+from openai import AsyncOpenAI
+import httpx
+import asyncio
+import orjson
 from datetime import datetime
 from typing import Optional, List, Dict
 import time
@@ -14,9 +16,12 @@ from config import (
     IST, 
     CEREBRAS_API_KEY, 
     CEREBRAS_BASE_URL, 
-    MODEL_ID
+    MODEL_ID,
+    SUMMARY_MODEL_ID,
+    SYSTEM_PROMPT_STATIC
 )
-from database import get_history, update_history
+from database import get_history, update_history, build_message, ensure_conversation_indexes
+from condenser import HistoryCondenser
 
 # --- INITIALIZATION ---
 app = FastAPI(title="Restaurant AI API")
@@ -33,17 +38,40 @@ app.add_middleware(
 # Mount static files directory for web UI
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Long-lived HTTP/2 connection pool so TLS handshakes are amortized across LLM calls
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=httpx.Timeout(30.0, connect=5.0)
+)
+
 # Initialize Cerebras client
-cerebras_client = OpenAI(
+cerebras_client = AsyncOpenAI(
     api_key=CEREBRAS_API_KEY,
-    base_url=CEREBRAS_BASE_URL
+    base_url=CEREBRAS_BASE_URL,
+    http_client=http_client
 )
 
 # Initialize Agent
 agent = RestaurantAgent(cerebras_client, MODEL_ID)
 
+# Initialize history condenser (rolling summary of older messages)
+condenser = HistoryCondenser(cerebras_client, SUMMARY_MODEL_ID)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-flight
+_background_tasks = set()
+
+def _spawn_background(coro):
+    """Schedule a coroutine without awaiting it, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
 # --- DATA MODELS ---
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     message_id: str
     restaurant_id: str
     store_id: Optional[str] = ""
@@ -60,15 +88,14 @@ class ConversationMessage(BaseModel):
     content: str
     timestamp: str = Field(default_factory=lambda: datetime.now(IST).isoformat())
 
-# --- SYSTEM PROMPT ---
-with open("prompt_v1.txt", "r") as f:
-    SYSTEM_PROMPT = f.read()
+# --- LIFECYCLE ---
+@app.on_event("startup")
+async def startup():
+    await ensure_conversation_indexes()
 
-# Load restaurant data from JSON file
-with open("restaurant_data.json", "r", encoding="utf-8") as f:
-    restaurant_data = json.load(f)
-
-SYSTEM_PROMPT = SYSTEM_PROMPT + "\n---\n## RESTAURANT DATA:\n" + json.dumps(restaurant_data, ensure_ascii=False, indent=2)
+@app.on_event("shutdown")
+async def shutdown():
+    await http_client.aclose()
 
 # --- API ENDPOINTS ---
 @app.get("/")
@@ -78,6 +105,22 @@ async def root():
     """
     return FileResponse("static/index.html")
 
+async def prepare_context(message_id: str, user_id: str, restaurant_id: str, message_body: str, now_iso: str):
+    """
+    Load summary + recent history, append the new user message and schedule condensation if due.
+    
+    Returns the conversation history for the agent and the user message to persist.
+    """
+    history_start = time.time()
+    conversation_history, unsummarized_count = await get_history(user_id, restaurant_id)
+    history_time = time.time() - history_start
+    user_message = build_message("user", message_body, now_iso)
+    conversation_history.append(user_message)
+    if condenser.should_condense(unsummarized_count):
+        _spawn_background(condenser.condense(user_id, restaurant_id))
+    request_logger.info(message_id, f"[COMPONENT_CONTEXT_PREP] Time: {history_time:.4f}s | Messages Prepared: {len(conversation_history)} | User: {user_id} | Restaurant: {restaurant_id}")
+    return conversation_history, user_message
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """
@@ -90,43 +133,36 @@ async def chat_endpoint(request: ChatRequest):
         user_id = request.contact_number
         restaurant_id = request.restaurant_id
         message_body = request.message
-        current_ist_time = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
+        # Read the clock once per request and derive both formats from it
+        now_iso = datetime.now(IST).isoformat(timespec="seconds")
+        current_ist_time = now_iso[:19].replace("T", " ")
         
         print("=="*20)
 
         # Log incoming request with full body
-        request_logger.info(message_id, f"[REQUEST_INCOMING] User: {user_id} | Restaurant: {restaurant_id} | IST: {current_ist_time}")
-        request_logger.info(message_id, f"[REQUEST_BODY] {json.dumps(request.dict(), indent=2)}")
-        request_logger.info(message_id, f"[REQUEST_MESSAGE] Content: {message_body}")
-        
-        # 1. Update History with User Message
-        history_start = time.time()
-        update_history(user_id, restaurant_id, "user", message_body)
-        history_time = time.time() - history_start
-        request_logger.info(message_id, f"[COMPONENT_HISTORY_UPDATE] Time: {history_time:.4f}s | User: {user_id} | Restaurant: {restaurant_id} | History Length: {len(get_history(user_id, restaurant_id))}")
+        if request_logger.is_enabled():
+            request_logger.info(message_id, f"[REQUEST_INCOMING] User: {user_id} | Restaurant: {restaurant_id} | IST: {current_ist_time}")
+            request_logger.info(message_id, f"[REQUEST_BODY] {request.model_dump_json()}")
+            request_logger.info(message_id, f"[REQUEST_MESSAGE] Content: {message_body}")
         
-        # 2. Prepare Context
-        system_prompt = SYSTEM_PROMPT.replace("{current_time}", current_ist_time)
-        conversation_history = get_history(user_id, restaurant_id)
-        request_logger.info(message_id, f"[COMPONENT_CONTEXT_PREP] Messages Prepared: {len(conversation_history)} | User: {user_id} | Restaurant: {restaurant_id}")
+        # 1. Prepare Context: summary + recent history plus the new user message
+        conversation_history, user_message = await prepare_context(message_id, user_id, restaurant_id, message_body, now_iso)
         
-        # 3. Process with Agent
+        # 2. Process with Agent
         agent_start = time.time()
-        final_reply = agent.process_message(
-            system_prompt=system_prompt,
+        final_reply = await agent.process_message(
+            system_prompt=SYSTEM_PROMPT_STATIC,
             conversation_history=conversation_history,
             message_id=message_id,
             user_id=user_id,
-            restaurant_id=restaurant_id
+            restaurant_id=restaurant_id,
+            current_time=current_ist_time
         )
         agent_time = time.time() - agent_start
         request_logger.info(message_id, f"[COMPONENT_AGENT] Time: {agent_time:.4f}s | User: {user_id} | Restaurant: {restaurant_id}")
         
-        # 4. Update History with Reply
-        history_reply_start = time.time()
-        update_history(user_id, restaurant_id, "assistant", final_reply)
-        history_reply_time = time.time() - history_reply_start
-        request_logger.info(message_id, f"[COMPONENT_HISTORY_UPDATE] Reply Update Time: {history_reply_time:.4f}s | User: {user_id} | Restaurant: {restaurant_id}")
+        # 3. Persist user message and reply together in the background (one Mongo write)
+        _spawn_background(update_history(user_id, restaurant_id, [user_message, build_message("assistant", final_reply)]))
         
         # Total request time
         total_time = time.time() - request_start_time
@@ -143,6 +179,53 @@ async def chat_endpoint(request: ChatRequest):
         request_logger.error(message_id, f"[REQUEST_ERROR] User: {request.contact_number} | Restaurant: {request.restaurant_id} | Error: {str(e)} | Time: {error_time:.4f}s")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Process a chat message and stream the final reply as server-sent events.
+    """
+    request_start_time = time.time()
+    message_id = request.message_id
+    user_id = request.contact_number
+    restaurant_id = request.restaurant_id
+    now_iso = datetime.now(IST).isoformat(timespec="seconds")
+    current_ist_time = now_iso[:19].replace("T", " ")
+    
+    request_logger.info(message_id, f"[STREAM_REQUEST_INCOMING] User: {user_id} | Restaurant: {restaurant_id} | IST: {current_ist_time}")
+    conversation_history, user_message = await prepare_context(message_id, user_id, restaurant_id, request.message, now_iso)
+    
+    async def event_stream():
+        final_reply = ""
+        try:
+            async for event, text in agent.process_message_stream(
+                system_prompt=SYSTEM_PROMPT_STATIC,
+                conversation_history=conversation_history,
+                message_id=message_id,
+                user_id=user_id,
+                restaurant_id=restaurant_id,
+                current_time=current_ist_time
+            ):
+                if event == "delta":
+                    yield b"data: " + orjson.dumps({"text": text}) + b"\n\n"
+                elif event == "retract":
+                    # Client drops the text shown so far for this reply
+                    yield b"event: retract\ndata: {}\n\n"
+                else:
+                    final_reply = text
+        except Exception as e:
+            error_time = time.time() - request_start_time
+            request_logger.error(message_id, f"[STREAM_REQUEST_ERROR] User: {user_id} | Restaurant: {restaurant_id} | Error: {str(e)} | Time: {error_time:.4f}s")
+            yield b"event: error\ndata: " + orjson.dumps({"error": str(e)}) + b"\n\n"
+            return
+        
+        _spawn_background(update_history(user_id, restaurant_id, [user_message, build_message("assistant", final_reply)]))
+        
+        total_time = time.time() - request_start_time
+        request_logger.info(message_id, f"[STREAM_REQUEST_COMPLETE] User: {user_id} | Restaurant: {restaurant_id} | Total Time: {total_time:.4f}s | Response Length: {len(final_reply)}")
+        yield b"data: [DONE]\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/health")
 def health_check():
     return {"status": "running"}
\ No newline at end of file
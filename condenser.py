@@ -0,0 +1,66 @@
+from openai import AsyncOpenAI
+from logging_config import request_logger
+from config import HISTORY_SUMMARY_THRESHOLD, HISTORY_KEEP_RECENT
+from database import get_summary_state, update_summary
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a WhatsApp conversation between a restaurant "
+    "assistant and a customer. Merge the previous summary with the new messages into a "
+    "short factual summary. Keep names, phone numbers, emails, dates, times, party sizes, "
+    "booking IDs and any pending requests. Reply with the summary only."
+)
+
+class HistoryCondenser:
+    """Folds older conversation messages into a rolling summary using a cheap model"""
+
+    def __init__(self, client: AsyncOpenAI, model_id: str):
+        self.client = client
+        self.model_id = model_id
+        self.logger = request_logger
+        self._in_flight = set()
+
+    def should_condense(self, unsummarized_count: int) -> bool:
+        """Check whether enough unsummarized messages have piled up"""
+        return unsummarized_count > HISTORY_SUMMARY_THRESHOLD
+
+    async def condense(self, user_id: str, restaurant_id: str) -> None:
+        """Summarize all but the most recent messages and store the result on the conversation"""
+        key = (user_id, restaurant_id)
+        if key in self._in_flight:
+            return
+        self._in_flight.add(key)
+        try:
+            conversation = await get_summary_state(user_id, restaurant_id)
+            if not conversation:
+                return
+
+            messages = conversation.get("messages", [])
+            message_count = conversation.get("message_count", len(messages))
+            previous_upto_index = conversation.get("summary_upto_index", 0)
+            if not self.should_condense(message_count - previous_upto_index):
+                return
+
+            # Summary indexes count every message ever appended; map them onto the capped array
+            trimmed_count = message_count - len(messages)
+            summary_upto_index = message_count - HISTORY_KEEP_RECENT
+            older_messages = messages[max(previous_upto_index - trimmed_count, 0):summary_upto_index - trimmed_count]
+            transcript = "\n".join(f"{m['role']}: {m['content']}" for m in older_messages)
+
+            response = await self.client.chat.completions.create(
+                model=self.model_id,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                    {"role": "user", "content": f"Previous summary:\n{conversation.get('summary') or 'None'}\n\nNew messages:\n{transcript}"}
+                ],
+                temperature=0.0
+            )
+            summary = (response.choices[0].message.content or "").strip()
+            if not summary:
+                return
+
+            await update_summary(user_id, restaurant_id, summary, previous_upto_index, summary_upto_index)
+            self.logger.info(f"Condensed {len(older_messages)} messages for user {user_id} | restaurant {restaurant_id}")
+        except Exception as e:
+            self.logger.error(f"Error condensing history for user {user_id} | restaurant {restaurant_id}: {e}")
+        finally:
+            self._in_flight.discard(key)
@@ -1,7 +1,11 @@
 import os
+import orjson
+import threading
+from functools import wraps
 from datetime import timezone, timedelta
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, OperationFailure
 from logging_config import request_logger
 from dotenv import load_dotenv
 load_dotenv()  
@@ -21,14 +25,66 @@ MONGO_COLLECTION = "conversations"
 MONGO_RESERVATIONS_COLLECTION = "reservations"
 MONGO_AVAILABILITY_COLLECTION = "availability"
 
+# --- CONCURRENCY CONFIGURATION ---
+TOOL_THREADS = 8  # Agent threads running blocking reservation (pymongo) calls, per worker process
+MONGO_SOCKET_TIMEOUT_MS = 10000  # Request-path socket timeout; scripts pass None for long index builds
+
+# --- HISTORY CONFIGURATION ---
+# Older messages are folded into a rolling summary by a cheaper model
+SUMMARY_MODEL_ID = os.environ.get("SUMMARY_MODEL_ID", "llama3.1-8b")
+HISTORY_SUMMARY_THRESHOLD = 20  # Unsummarized messages that trigger a summary refresh
+HISTORY_KEEP_RECENT = 5  # Messages kept verbatim after summarizing
+HISTORY_MAX_MESSAGES = 200  # Raw messages retained per conversation document
+
 # --- RESTAURANT CONFIGURATION ---
 STORE_ID = os.environ.get("STORE_ID", "2u8zw0on")
 
+# --- SYSTEM PROMPT ---
+# Loaded once here so app.py and gradio_app.py share a single copy
+with open("prompt_v1.txt", "r") as f:
+    _PROMPT_TEMPLATE = f.read()
+
+with open("restaurant_data.json", "rb") as f:
+    RESTAURANT_DATA = orjson.loads(f.read())
+
+# Static prefix: never mutated per request so the provider can reuse its prompt cache.
+# Compact UTF-8 JSON (orjson) keeps the prompt smaller than an indented dump.
+SYSTEM_PROMPT_STATIC = _PROMPT_TEMPLATE + "\n---\n## RESTAURANT DATA:\n" + orjson.dumps(RESTAURANT_DATA).decode()
+
 # --- MONGODB CONNECTION ---
-def get_mongo_client():
-    """Initialize and return MongoDB client"""
+def _singleton(func):
+    """Memoize a getter per arguments; the lock keeps concurrent tool threads from building it twice"""
+    cache = {}
+    lock = threading.Lock()
+    
+    @wraps(func)
+    def wrapper(*args):
+        if args not in cache:
+            with lock:
+                if args not in cache:
+                    cache[args] = func(*args)
+        return cache[args]
+    return wrapper
+
+@_singleton
+def get_mongo_client(socket_timeout_ms=MONGO_SOCKET_TIMEOUT_MS):
+    """
+    Initialize and return the shared, pooled MongoDB client (connection verified once).
+    
+    One client per socket timeout; seed/migration scripts pass None so index builds and
+    bulk writes are not cut off by the request-path timeout.
+    """
     try:
-        mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+        # Pool sized to the tool threads so concurrent bookings never queue for a socket
+        mongo_client = MongoClient(
+            MONGO_URI,
+            maxPoolSize=TOOL_THREADS * 2,
+            minPoolSize=TOOL_THREADS,
+            retryWrites=True,
+            w="majority",
+            socketTimeoutMS=socket_timeout_ms,
+            serverSelectionTimeoutMS=2000
+        )
         mongo_client.admin.command('ping')
         request_logger.info("Connected to MongoDB successfully")
         return mongo_client
@@ -36,25 +92,39 @@ def get_mongo_client():
         request_logger.error(f"Failed to connect to MongoDB: {e}")
         raise
 
-def get_conversations_collection():
-    """Get conversations collection and create index"""
+@_singleton
+def get_async_mongo_client():
+    """Initialize and return the shared asyncio MongoDB client (connection is verified on first use)"""
+    return AsyncIOMotorClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+
+@_singleton
+def get_async_conversations_collection():
+    """Get conversations collection for use from async code (indexes via ensure_conversation_indexes)"""
     try:
-        mongo_client = get_mongo_client()
+        mongo_client = get_async_mongo_client()
         db = mongo_client[MONGO_DB]
-        conversations_collection = db[MONGO_COLLECTION]
-        conversations_collection.create_index([("contact_number", 1), ("restaurant_id", 1)])
-        return conversations_collection
+        return db[MONGO_COLLECTION]
     except Exception as e:
-        request_logger.error(f"Failed to get conversations collection: {e}")
+        request_logger.error(f"Failed to get async conversations collection: {e}")
         raise
 
+# IndexOptionsConflict / IndexKeySpecsConflict: an index on the same keys exists with other options
+INDEX_CONFLICT_CODES = (85, 86)
+
+@_singleton
 def get_reservations_collection():
-    """Get reservations collection and create indices"""
+    """Get reservations collection, creating its indices on first call"""
     try:
         mongo_client = get_mongo_client()
         db = mongo_client[MONGO_DB]
         reservations_collection = db[MONGO_RESERVATIONS_COLLECTION]
-        reservations_collection.create_index([("booking_id", 1)])
+        try:
+            reservations_collection.create_index([("booking_id", 1)], unique=True)
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+            # Keep the non-unique index from earlier versions; migrate_db.py upgrades it
+            request_logger.warning(f"booking_id index is not unique yet, run migrate_db.py: {e}")
         reservations_collection.create_index([("customer_details.contact_number", 1)])
         reservations_collection.create_index([("reservation_details.date", 1)])
         return reservations_collection
@@ -62,14 +132,23 @@ def get_reservations_collection():
         request_logger.error(f"Failed to get reservations collection: {e}")
         raise
 
+def ensure_availability_indexes(availability_collection):
+    """Create availability indices (one document per store/date/time slot)"""
+    # Serves get_inventory's (store_id, date, time range) lookup and the booking update filters
+    availability_collection.create_index(
+        [("store_id", 1), ("date", 1), ("time", 1)],
+        unique=True,
+        name="slot_time_key"
+    )
+
+@_singleton
 def get_availability_collection():
-    """Get availability collection and create indices"""
+    """Get availability collection, creating its indices on first call"""
     try:
         mongo_client = get_mongo_client()
         db = mongo_client[MONGO_DB]
         availability_collection = db[MONGO_AVAILABILITY_COLLECTION]
-        availability_collection.create_index([("date", 1), ("time", 1), ("covers", 1)])
-        availability_collection.create_index([("date", 1), ("is_available", 1)])
+        ensure_availability_indexes(availability_collection)
         return availability_collection
     except Exception as e:
         request_logger.error(f"Failed to get availability collection: {e}")
@@ -1,60 +1,128 @@
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Tuple, Optional
 from logging_config import request_logger
-from config import IST, get_conversations_collection
+from config import IST, get_async_conversations_collection, HISTORY_SUMMARY_THRESHOLD, HISTORY_MAX_MESSAGES
 
-conversations_collection = get_conversations_collection()
+conversations_collection = get_async_conversations_collection()
 
-def get_history(user_id: str, restaurant_id: str) -> List[Dict[str, str]]:
-    """Fetch conversation history from MongoDB for a specific user and restaurant"""
+async def ensure_conversation_indexes() -> None:
+    """Verify the MongoDB connection and create the conversations index"""
     try:
-        conversation = conversations_collection.find_one({
-            "contact_number": user_id,
-            "restaurant_id": restaurant_id
-        })
-        if conversation and "messages" in conversation:
-            messages = conversation["messages"]
-            recent_messages = messages[-5:] if len(messages) > 5 else messages
-            request_logger.info(f"Fetched history for user {user_id} | restaurant {restaurant_id} | Total: {len(messages)} | Recent: {len(recent_messages)}")
-            return recent_messages
-        return []
+        await conversations_collection.database.client.admin.command('ping')
+        await conversations_collection.create_index([("contact_number", 1), ("restaurant_id", 1)])
+        request_logger.info("Connected to MongoDB successfully")
+    except Exception as e:
+        request_logger.error(f"Failed to prepare conversations collection: {e}")
+        raise
+
+SUMMARY_PREFIX = "Summary so far: "
+
+async def get_history(user_id: str, restaurant_id: str) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Fetch conversation history from MongoDB for a specific user and restaurant.
+    
+    Returns the rolling summary (as a system message) followed by the messages not yet
+    summarized, plus the number of unsummarized messages so callers can trigger condensation.
+    """
+    try:
+        # Index seek on (contact_number, restaurant_id) and a server-side tail slice, so only
+        # the recent messages cross the wire regardless of total history length
+        conversation = await conversations_collection.find_one(
+            {"contact_number": user_id, "restaurant_id": restaurant_id},
+            projection={
+                "messages": {"$slice": -HISTORY_SUMMARY_THRESHOLD},
+                "message_count": 1,
+                "summary": 1,
+                "summary_upto_index": 1,
+                "_id": 0
+            }
+        )
+        if conversation and conversation.get("messages"):
+            tail = conversation["messages"]
+            # Conversations not yet backfilled by migrate_db.py fall back to the fetched tail
+            message_count = conversation.get("message_count", len(tail))
+            unsummarized_count = message_count - conversation.get("summary_upto_index", 0)
+            # Bound the verbatim tail even if summarization is lagging behind
+            recent_messages = tail[len(tail) - min(unsummarized_count, len(tail)):]
+            history = []
+            if conversation.get("summary"):
+                history.append({"role": "system", "content": SUMMARY_PREFIX + conversation["summary"]})
+            history.extend(recent_messages)
+            request_logger.info(f"Fetched history for user {user_id} | restaurant {restaurant_id} | Total: {message_count} | Unsummarized: {unsummarized_count} | Recent: {len(recent_messages)}")
+            return history, unsummarized_count
+        return [], 0
     except Exception as e:
         request_logger.error(f"Error fetching history for user {user_id} | restaurant {restaurant_id}: {e}")
-        return []
+        return [], 0
 
-def update_history(user_id: str, restaurant_id: str, role: str, content: str) -> None:
-    """Update conversation history in MongoDB for a specific user and restaurant"""
+async def get_summary_state(user_id: str, restaurant_id: str) -> Optional[Dict]:
+    """Fetch the raw messages and current summary fields for condensation"""
     try:
-        current_ist_time = datetime.now(IST).isoformat()
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": current_ist_time
-        }
-        
-        conversations_collection.update_one(
+        return await conversations_collection.find_one(
+            {"contact_number": user_id, "restaurant_id": restaurant_id},
+            projection={"messages": 1, "message_count": 1, "summary": 1, "summary_upto_index": 1, "_id": 0}
+        )
+    except Exception as e:
+        request_logger.error(f"Error fetching summary state for user {user_id} | restaurant {restaurant_id}: {e}")
+        return None
+
+async def update_summary(user_id: str, restaurant_id: str, summary: str, previous_upto_index: int, summary_upto_index: int) -> bool:
+    """
+    Store a new rolling summary covering the first summary_upto_index messages ever appended.
+    
+    Indexes count all messages since the conversation started (see message_count), so they
+    stay valid after old raw messages are trimmed from the array.
+    
+    The update only applies if no other writer has advanced the summary since it was read.
+    """
+    try:
+        expected_index = previous_upto_index if previous_upto_index else {"$in": [0, None]}
+        result = await conversations_collection.update_one(
+            {
+                "contact_number": user_id,
+                "restaurant_id": restaurant_id,
+                "summary_upto_index": expected_index
+            },
+            {"$set": {"summary": summary, "summary_upto_index": summary_upto_index}}
+        )
+        request_logger.info(f"Summary updated for user {user_id} | restaurant {restaurant_id} | Up to: {summary_upto_index} | Applied: {result.modified_count > 0}")
+        return result.modified_count > 0
+    except Exception as e:
+        request_logger.error(f"Error updating summary for user {user_id} | restaurant {restaurant_id}: {e}")
+        return False
+
+def build_message(role: str, content: str, timestamp: Optional[str] = None) -> Dict[str, str]:
+    """Build a history message stamped with the given (or current) IST time"""
+    return {
+        "role": role,
+        "content": content,
+        "timestamp": timestamp or datetime.now(IST).isoformat(timespec="seconds")
+    }
+
+async def update_history(user_id: str, restaurant_id: str, messages: List[Dict[str, str]]) -> None:
+    """
+    Append messages to the conversation history in MongoDB in a single write.
+    
+    The raw array is capped at HISTORY_MAX_MESSAGES; message_count keeps the running total.
+    """
+    try:
+        await conversations_collection.update_one(
             {
                 "contact_number": user_id,
                 "restaurant_id": restaurant_id
             },
-            [
-                {
-                    "$set": {
-                        "messages": {
-                            "$concatArrays": [
-                                {"$ifNull": ["$messages", []]},
-                                [message]
-                            ]
-                        },
-                        "last_updated": current_ist_time,
-                        "contact_number": user_id,
-                        "restaurant_id": restaurant_id
-                    }
+            {
+                "$push": {"messages": {"$each": messages, "$slice": -HISTORY_MAX_MESSAGES}},
+                "$inc": {"message_count": len(messages)},
+                "$set": {"last_updated": messages[-1]["timestamp"]},
+                "$setOnInsert": {
+                    "contact_number": user_id,
+                    "restaurant_id": restaurant_id
                 }
-            ],
+            },
             upsert=True
         )
         
-        request_logger.info(f"History updated for user {user_id} | restaurant {restaurant_id}")
+        request_logger.info(f"History updated for user {user_id} | restaurant {restaurant_id} | Added: {len(messages)}")
     except Exception as e:
         request_logger.error(f"Error updating history for user {user_id} | restaurant {restaurant_id}: {e}")
@@ -1,16 +1,15 @@
 import gradio as gr
-import json
 from datetime import datetime
 from typing import List, Tuple
 from config import IST
 from agent import RestaurantAgent
-from openai import OpenAI
+from openai import AsyncOpenAI
 from logging_config import request_logger
 import uuid
-from config import CEREBRAS_API_KEY, CEREBRAS_BASE_URL, MODEL_ID
+from config import CEREBRAS_API_KEY, CEREBRAS_BASE_URL, MODEL_ID, SYSTEM_PROMPT_STATIC
 
 # Initialize Cerebras client
-cerebras_client = OpenAI(
+cerebras_client = AsyncOpenAI(
     api_key=CEREBRAS_API_KEY,
     base_url=CEREBRAS_BASE_URL
 )
@@ -18,16 +17,6 @@ cerebras_client = OpenAI(
 # Initialize Agent
 agent = RestaurantAgent(cerebras_client, MODEL_ID)
 
-# Load system prompt
-with open("prompt_v1.txt", "r") as f:
-    SYSTEM_PROMPT = f.read()
-
-# Load restaurant data
-with open("restaurant_data.json", "r", encoding="utf-8") as f:
-    restaurant_data = json.load(f)
-
-SYSTEM_PROMPT = SYSTEM_PROMPT + "\n---\n## RESTAURANT DATA:\n" + json.dumps(restaurant_data, ensure_ascii=False, indent=2)
-
 # class SimpleChatApp:
 #     def __init__(self):
 #         self.conversation_history: List[Tuple[str, str]] = []
@@ -84,7 +73,7 @@ class SimpleChatApp:
         # Gradio now expects a list of dicts: [{"role": "user", "content": "..."}, ...]
         self.conversation_history: List[dict] = []
         
-    def send_message(self, user_message: str) -> List[dict]:
+    async def send_message(self, user_message: str) -> List[dict]:
         """Send message to agent and update conversation history."""
         
         if not user_message.strip():
@@ -94,20 +83,18 @@ class SimpleChatApp:
             current_ist_time = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
             message_id = str(uuid.uuid4())
             
-            # Prepare system prompt
-            system_prompt = SYSTEM_PROMPT.replace("{current_time}", current_ist_time)
-            
             # Use current history directly (since it's already in role/content format)
             # but add the new user message first
             self.conversation_history.append({"role": "user", "content": user_message})
             
             # Process with agent
-            response = agent.process_message(
-                system_prompt=system_prompt,
+            response = await agent.process_message(
+                system_prompt=SYSTEM_PROMPT_STATIC,
                 conversation_history=self.conversation_history, # Already formatted!
                 message_id=message_id,
                 user_id="user",
-                restaurant_id="test"
+                restaurant_id="test",
+                current_time=current_ist_time
             )
             
             # Update history with assistant response
@@ -0,0 +1,20 @@
+"""
+Gunicorn configuration for serving app.py with Uvicorn workers.
+
+Usage: gunicorn -c gunicorn_conf.py app:app
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# UvicornWorker picks up uvloop and httptools automatically when they are installed
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Request time is dominated by Cerebras/MongoDB I/O wait, so scale past the core count
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+# Leave room for the multi-iteration agent loop on slow LLM responses
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
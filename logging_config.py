@@ -1,54 +1,64 @@
 import logging
-from datetime import timezone, timedelta
+import time
 from typing import Optional
 
+# IST is UTC+05:30; shifting epoch seconds avoids a datetime allocation per log record
+IST_OFFSET_SECONDS = 5 * 3600 + 30 * 60
+
+class ISTFormatter(logging.Formatter):
+    """Formatter that renders %(asctime)s in IST"""
+    
+    @staticmethod
+    def converter(timestamp):
+        return time.gmtime(timestamp + IST_OFFSET_SECONDS)
+
 # --- CUSTOM LOGGING HELPER ---
 class RequestLogger:
     """Scalable logger that accepts message_id as parameter for multi-worker support"""
     
     def __init__(self, logger_name: str):
         self.logger = logging.getLogger(logger_name)
-        self.ist = timezone(timedelta(hours=5, minutes=30))
-    
-    def _format_log(self, message: str, message_id: str = "SYSTEM") -> str:
-        """Format log with IST timestamp, message_id, and line number"""
-        from datetime import datetime
-        ist_time = datetime.now(self.ist).strftime("%Y-%m-%d %H:%M:%S")
-        return f"{ist_time} - {message_id} - {message}"
     
     def info(self, message_or_id: str, message: Optional[str] = None):
         """Log info level - supports both info(msg_id, msg) and info(msg) formats"""
         if message is None:
-            self.logger.info(self._format_log(message_or_id))
+            self.logger.info("SYSTEM - %s", message_or_id)
         else:
-            self.logger.info(self._format_log(message, message_or_id))
+            self.logger.info("%s - %s", message_or_id, message)
     
     def error(self, message_or_id: str, message: Optional[str] = None):
         """Log error level - supports both error(msg_id, msg) and error(msg) formats"""
         if message is None:
-            self.logger.error(self._format_log(message_or_id))
+            self.logger.error("SYSTEM - %s", message_or_id)
         else:
-            self.logger.error(self._format_log(message, message_or_id))
+            self.logger.error("%s - %s", message_or_id, message)
     
     def warning(self, message_or_id: str, message: Optional[str] = None):
         """Log warning level - supports both warning(msg_id, msg) and warning(msg) formats"""
         if message is None:
-            self.logger.warning(self._format_log(message_or_id))
+            self.logger.warning("SYSTEM - %s", message_or_id)
         else:
-            self.logger.warning(self._format_log(message, message_or_id))
+            self.logger.warning("%s - %s", message_or_id, message)
     
     def debug(self, message_or_id: str, message: Optional[str] = None):
         """Log debug level - supports both debug(msg_id, msg) and debug(msg) formats"""
         if message is None:
-            self.logger.debug(self._format_log(message_or_id))
+            self.logger.debug("SYSTEM - %s", message_or_id)
         else:
-            self.logger.debug(self._format_log(message, message_or_id))
+            self.logger.debug("%s - %s", message_or_id, message)
+    
+    def is_enabled(self, level: int = logging.INFO) -> bool:
+        """Check whether a level would be emitted, to skip building expensive messages"""
+        return self.logger.isEnabledFor(level)
 
 def setup_logging():
     """Configure logging with IST timezone support"""
+    # Stream-only handler (no shared file handles), so it is safe under multiple worker processes
+    handler = logging.StreamHandler()
+    handler.setFormatter(ISTFormatter('%(asctime)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S"))
     logging.basicConfig(
         level=logging.INFO,
-        format='%(message)s'
+        handlers=[handler]
     )
     return RequestLogger("API")
 
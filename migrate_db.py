@@ -0,0 +1,74 @@
+"""
+One-off migration script for existing MongoDB data
+Run once per database before deploying a new version: python migrate_db.py
+"""
+
+from pymongo.errors import OperationFailure, PyMongoError
+from config import (
+    get_mongo_client,
+    MONGO_DB,
+    MONGO_COLLECTION,
+    MONGO_RESERVATIONS_COLLECTION,
+    INDEX_CONFLICT_CODES
+)
+from logging_config import request_logger
+
+def backfill_message_count():
+    """Set message_count on conversations written before the counter existed"""
+    try:
+        conversations_col = get_mongo_client(None)[MONGO_DB][MONGO_COLLECTION]
+        result = conversations_col.update_many(
+            {"message_count": {"$exists": False}},
+            [{"$set": {"message_count": {"$size": {"$ifNull": ["$messages", []]}}}}]
+        )
+        print(f"✓ Backfilled message_count on {result.modified_count} conversations")
+        return True
+    except Exception as e:
+        request_logger.error(f"Error backfilling message_count: {e}")
+        print(f"✗ Error backfilling message_count: {e}")
+        return False
+
+def make_booking_id_unique():
+    """Replace the non-unique booking_id index from earlier versions with a unique one"""
+    try:
+        reservations_col = get_mongo_client(None)[MONGO_DB][MONGO_RESERVATIONS_COLLECTION]
+        try:
+            reservations_col.create_index([("booking_id", 1)], unique=True)
+            print("✓ booking_id index is unique")
+            return True
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+        
+        # Millisecond-clock IDs from earlier versions can collide; leave the old index alone then
+        duplicates = list(reservations_col.aggregate([
+            {"$group": {"_id": "$booking_id", "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+            {"$limit": 10}
+        ]))
+        if duplicates:
+            print(f"✗ Duplicate booking IDs found, keeping the non-unique index: {[d['_id'] for d in duplicates]}")
+            return False
+        
+        reservations_col.drop_index("booking_id_1")
+        try:
+            reservations_col.create_index([("booking_id", 1)], unique=True)
+        except PyMongoError:
+            # A duplicate slipped in or the build failed; restore the previous index before failing
+            reservations_col.create_index([("booking_id", 1)])
+            raise
+        print("✓ Rebuilt booking_id index as unique")
+        return True
+    except Exception as e:
+        request_logger.error(f"Error migrating booking_id index: {e}")
+        print(f"✗ Error migrating booking_id index: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🚀 Running MongoDB migrations...\n")
+
+    results = [backfill_message_count(), make_booking_id_unique()]
+    if all(results):
+        print("\n✅ Migrations completed successfully!")
+    else:
+        print("\n❌ Migrations failed!")
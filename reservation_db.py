@@ -1,11 +1,50 @@
 import time
+import threading
 from datetime import datetime, timedelta, timezone
 import json
+from bson import ObjectId
+from pymongo import ReturnDocument
 from config import IST, get_reservations_collection, get_availability_collection, STORE_ID
 from logging_config import request_logger
 
-# In-memory storage for mapping booking IDs to MongoDB IDs
-BOOKING_ID_MAP = {}
+# Short-lived cache of found bookings for repeated status checks: booking_id -> (expires_at, payload)
+# Tools run on the agent's thread pool, hence the lock. Per process, so other workers may
+# serve a status up to BOOKING_STATUS_TTL seconds stale after a cancellation.
+BOOKING_STATUS_TTL = 15
+BOOKING_STATUS_CACHE_SIZE = 10000
+_booking_status_cache = {}
+_booking_status_lock = threading.Lock()
+
+def _cached_booking_status(booking_id):
+    """Return a cached status payload if it has not expired"""
+    with _booking_status_lock:
+        entry = _booking_status_cache.get(booking_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _booking_status_cache[booking_id]
+            return None
+        return entry[1]
+
+def _cache_booking_status(booking_id, payload):
+    """Store a status payload, evicting the oldest entry when full"""
+    with _booking_status_lock:
+        if len(_booking_status_cache) >= BOOKING_STATUS_CACHE_SIZE:
+            _booking_status_cache.pop(next(iter(_booking_status_cache)))
+        _booking_status_cache[booking_id] = (time.monotonic() + BOOKING_STATUS_TTL, payload)
+
+def _invalidate_booking_status(booking_id):
+    """Drop a cached status after the booking changes"""
+    with _booking_status_lock:
+        _booking_status_cache.pop(booking_id, None)
+
+def _normalize_hm(hm_str):
+    """Parse "H:MM"/"HH:MM" via integer minutes and return zero-padded "HH:MM" (24:00 allowed)"""
+    hours, minutes = hm_str.strip().split(":")
+    total = int(hours) * 60 + int(minutes)
+    if not 0 <= total <= 24 * 60 or not 0 <= int(minutes) < 60:
+        raise ValueError(f"Invalid time: {hm_str}")
+    return f"{total // 60:02d}:{total % 60:02d}"
 
 def get_inventory(date_str, start_time, end_time, covers):
     """
@@ -16,49 +55,51 @@ def get_inventory(date_str, start_time, end_time, covers):
     covers: Number of guests
     
     Returns all available slots between start_time and end_time.
-    Automatically filters out any slots that are in the past.
+    Automatically filters out any slots that are in the past (time range and
+    past-slot filtering both happen in the MongoDB query).
     """
     try:
         availability_col = get_availability_collection()
         
-        # Parse inputs
-        start_dt_str = f"{date_str} {start_time}"
-        end_dt_str = f"{date_str} {end_time}"
+        # Validate the date format; the comparisons below rely on "YYYY-MM-DD" strings
+        datetime.strptime(date_str, "%Y-%m-%d")
+        # Tool arguments may carry 2.0 for 2; the field path below needs the integer key
+        covers = int(covers)
         
-        start_naive = datetime.strptime(start_dt_str, "%Y-%m-%d %H:%M")
-        end_naive = datetime.strptime(end_dt_str, "%Y-%m-%d %H:%M")
+        # Zero-padded "HH:MM" strings order lexicographically, so the time window is filtered
+        # by MongoDB; bounds are normalized once instead of parsing every slot
+        now = datetime.now(IST)
+        today_str = now.strftime("%Y-%m-%d")
+        time_filter = {"$gte": _normalize_hm(start_time), "$lte": _normalize_hm(end_time)}
+        if date_str == today_str:
+            time_filter["$gt"] = f"{now.hour:02d}:{now.minute:02d}"
         
-        start_dt = start_naive.replace(tzinfo=IST)
-        end_dt = end_naive.replace(tzinfo=IST)
-        
-        current_time = datetime.now(IST)
-        
-        # Query availability from MongoDB
+        # Query availability from MongoDB (one document per time slot, tables keyed by cover size)
+        available_field = f"available.{covers}"
         query = {
-            "date": date_str,
             "store_id": STORE_ID,
-            "covers": covers,
-            "is_available": True,
-            "available_tables": {"$gt": 0}
+            "date": date_str,
+            "time": time_filter,
+            available_field: {"$gt": 0}
         }
         
-        slots = list(availability_col.find(query))
+        # Past dates have no bookable slots. The cursor is consumed lazily in one batch
+        # (a day has far fewer than 200 slots) and only time + this party size's count are decoded.
+        slots = [] if date_str < today_str else (
+            availability_col.find(query, projection={"_id": 1, "time": 1, available_field: 1})
+            .sort("time", 1)
+            .batch_size(200)
+        )
         
-        # Filter slots that are within the requested time range and in the future
         filtered_slots = []
         for slot in slots:
-            slot_time_str = f"{date_str} {slot['time']}"
-            slot_naive = datetime.strptime(slot_time_str, "%Y-%m-%d %H:%M")
-            slot_dt = slot_naive.replace(tzinfo=IST)
-            
-            # Check if slot is within range and in the future
-            if start_dt <= slot_dt <= end_dt and slot_dt > current_time:
-                filtered_slots.append({
-                    "startTime": slot['time'],
-                    "slotId": str(slot.get('_id', '')),
-                    "availableTables": slot.get('available_tables', covers),
-                    "explanation": f"{slot.get('available_tables', covers)} tables available, each fits {covers} people"
-                })
+            available_tables = slot["available"][str(covers)]
+            filtered_slots.append({
+                "startTime": slot['time'],
+                "slotId": str(slot.get('_id', '')),
+                "availableTables": available_tables,
+                "explanation": f"{available_tables} tables available, each fits {covers} people"
+            })
         
         request_logger.info(f"Inventory check: date={date_str}, found {len(filtered_slots)} available slots for {covers} covers")
         
@@ -83,8 +124,14 @@ def create_booking(name, phone, email, date_str, time_str, covers, notes=None):
         reservations_col = get_reservations_collection()
         availability_col = get_availability_collection()
         
-        # Generate a unique booking ID using milliseconds (not seconds) to avoid collisions
-        booking_id = f"BK-{int(time.time() * 1000)}"
+        # ObjectIds are unique without coordination and roughly time-ordered; the same id is
+        # used as the document _id, so the reference and the stored document share one key
+        booking_oid = ObjectId()
+        booking_id = f"BK-{booking_oid}"
+        
+        # Slots are stored as zero-padded "HH:MM", so "9:00" must become "09:00" to match
+        time_str = _normalize_hm(time_str)
+        covers = int(covers)
         
         dt_str = f"{date_str} {time_str}"
         naive_dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
@@ -92,6 +139,7 @@ def create_booking(name, phone, email, date_str, time_str, covers, notes=None):
         
         # Create booking document
         booking_doc = {
+            "_id": booking_oid,
             "booking_id": booking_id,
             "status": "confirmed",
             "customer_details": {
@@ -103,7 +151,7 @@ def create_booking(name, phone, email, date_str, time_str, covers, notes=None):
             "reservation_details": {
                 "date": date_str,
                 "time": time_str,
-                "covers": int(covers),
+                "covers": covers,
                 "duration": 60,  # Default 60 minutes
                 "notes": notes if notes else []
             },
@@ -112,25 +160,47 @@ def create_booking(name, phone, email, date_str, time_str, covers, notes=None):
             "slot_start_time": int(slot_start_time.timestamp())
         }
         
-        # Insert booking
-        result = reservations_col.insert_one(booking_doc)
-        booking_doc_id = str(result.inserted_id)
+        slot_filter = {
+            "store_id": STORE_ID,
+            "date": date_str,
+            "time": time_str
+        }
+        available_field = f"available.{covers}"
         
-        # Update availability - mark slot as unavailable
-        availability_col.update_one(
-            {
-                "date": date_str,
-                "time": time_str,
-                "covers": covers,
-                "store_id": STORE_ID
-            },
-            {
-                "$inc": {"available_tables": -1}
-            }
+        # Claim a table atomically: only matches while tables remain for this party size
+        claim = availability_col.update_one(
+            {**slot_filter, available_field: {"$gt": 0}},
+            {"$inc": {available_field: -1}}
         )
         
-        # Store the mapping
-        BOOKING_ID_MAP[booking_id] = booking_doc_id
+        if claim.matched_count == 0:
+            # Rare path: tell "no such slot" and "no table for this party size" apart from "sold out"
+            slot = availability_col.find_one(slot_filter, projection={"_id": 1, available_field: 1})
+            if not slot:
+                request_logger.info(f"Booking rejected: no slot on {date_str} at {time_str}")
+                return {
+                    "error": f"There is no reservation slot on {date_str} at {time_str}. Please check availability first.",
+                    "status": "failed"
+                }
+            if str(covers) not in slot.get("available", {}):
+                request_logger.info(f"Booking rejected: no table type for {covers} covers")
+                return {
+                    "error": f"We don't have tables for a party of {covers}, so this party size can't be booked online at any time. Please call us directly.",
+                    "status": "failed"
+                }
+            request_logger.info(f"Booking rejected: no tables left on {date_str} at {time_str} for {covers} covers")
+            return {
+                "error": "This slot is no longer available. Please choose another time.",
+                "status": "failed"
+            }
+        
+        # Insert booking only after the table is secured; release it again if the insert fails
+        try:
+            result = reservations_col.insert_one(booking_doc)
+        except Exception:
+            availability_col.update_one(slot_filter, {"$inc": {available_field: 1}})
+            raise
+        booking_doc_id = str(result.inserted_id)
         
         request_logger.info(f"Booking created: {booking_id} for {name} on {date_str} at {time_str} for {covers} covers")
         
@@ -158,43 +228,46 @@ def cancel_booking(booking_id, reason="User requested cancellation"):
         reservations_col = get_reservations_collection()
         availability_col = get_availability_collection()
         
-        # Find the booking
-        booking = reservations_col.find_one({"booking_id": booking_id})
-        
-        if not booking:
-            return {
-                "error": "Booking not found",
-                "booking_id": booking_id,
-                "status": "not_found"
-            }
-        
-        # Update booking status
-        reservations_col.update_one(
-            {"booking_id": booking_id},
+        # Flip status and fetch the pre-image in one round-trip
+        booking = reservations_col.find_one_and_update(
+            {"booking_id": booking_id, "status": {"$ne": "cancelled"}},
             {
                 "$set": {
                     "status": "cancelled",
                     "cancelled_at": datetime.now(IST).isoformat(),
                     "cancellation_reason": reason
                 }
-            }
+            },
+            projection={"reservation_details": 1, "_id": 0},
+            return_document=ReturnDocument.BEFORE
         )
         
+        if not booking:
+            # Rare path: tell "already cancelled" apart from "unknown booking"
+            if reservations_col.find_one({"booking_id": booking_id}, projection={"_id": 1}):
+                return {
+                    "status": "success",
+                    "booking_id": booking_id,
+                    "message": f"Your booking {booking_id} is already cancelled"
+                }
+            return {
+                "error": "Booking not found",
+                "booking_id": booking_id,
+                "status": "not_found"
+            }
+        
         # Restore availability
         reservation_details = booking.get("reservation_details", {})
         availability_col.update_one(
             {
+                "store_id": STORE_ID,
                 "date": reservation_details.get("date"),
-                "time": reservation_details.get("time"),
-                "covers": reservation_details.get("covers"),
-                "store_id": STORE_ID
+                "time": reservation_details.get("time")
             },
-            {
-                "$set": {"is_available": True},
-                "$inc": {"available_tables": 1}
-            }
+            {"$inc": {f"available.{int(reservation_details.get('covers'))}": 1}}
         )
         
+        _invalidate_booking_status(booking_id)
         request_logger.info(f"Booking cancelled: {booking_id} - Reason: {reason}")
         
         return {
@@ -212,6 +285,10 @@ def get_booking_status(booking_id):
     Checks status of a booking from MongoDB.
     """
     try:
+        cached = _cached_booking_status(booking_id)
+        if cached is not None:
+            return cached
+        
         reservations_col = get_reservations_collection()
         
         booking = reservations_col.find_one({"booking_id": booking_id})
@@ -226,7 +303,7 @@ def get_booking_status(booking_id):
         reservation_details = booking.get("reservation_details", {})
         customer_details = booking.get("customer_details", {})
         
-        return {
+        payload = {
             "status": booking.get("status", "unknown"),
             "booking_id": booking_id,
             "customer_name": customer_details.get("name"),
@@ -236,6 +313,8 @@ def get_booking_status(booking_id):
             "created_at": booking.get("created_at"),
             "message": f"Your booking {booking_id} is {booking.get('status', 'unknown').lower()}"
         }
+        _cache_booking_status(booking_id, payload)
+        return payload
     
     except Exception as e:
         request_logger.error(f"Error in get_booking_status: {e}")
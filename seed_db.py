@@ -4,10 +4,35 @@ This creates availability slots based on restaurant operating hours from restaur
 """
 
 from datetime import datetime, timedelta, timezone
-import json
-from config import get_availability_collection, STORE_ID, IST
+from itertools import islice
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from pymongo.write_concern import WriteConcern
+from config import (
+    get_mongo_client,
+    ensure_availability_indexes,
+    STORE_ID,
+    IST,
+    RESTAURANT_DATA,
+    MONGO_DB,
+    MONGO_AVAILABILITY_COLLECTION
+)
 from logging_config import request_logger
 
+def hm12_to_minutes(time_str):
+    """Convert a 12-hour time like '9:00 AM' or '12:30 PM' to minutes since midnight"""
+    clock, period = time_str.strip().split()
+    hours, minutes = (int(part) for part in clock.split(":"))
+    if not 1 <= hours <= 12 or not 0 <= minutes < 60 or period.upper() not in ("AM", "PM"):
+        raise ValueError(f"Invalid time: {time_str}")
+    return (hours % 12 + (12 if period.upper() == "PM" else 0)) * 60 + minutes
+
+def gen_slots(start_min, end_min, step=30):
+    """Generate "HH:MM" slots from start_min to end_min inclusive, wrapping past midnight"""
+    if end_min < start_min:
+        end_min += 24 * 60
+    return [f"{(m // 60) % 24:02d}:{m % 60:02d}" for m in range(start_min, end_min + 1, step)]
+
 def parse_time_slots(time_str):
     """
     Parse time string like '12:00 PM - 11:30 PM' or '12:30 AM' into time slots
@@ -19,49 +44,14 @@ def parse_time_slots(time_str):
             print(f"Warning: Could not parse time string: {time_str}")
             return []
         
-        start_str = parts[0].strip()
-        end_str = parts[1].strip()
-        
-        # Parse start time
-        start_time = datetime.strptime(start_str, "%I:%M %p").time()
-        
-        # For end time, handle next-day times (e.g., 12:30 AM)
-        end_dt = datetime.strptime(end_str, "%I:%M %p")
-        end_time = end_dt.time()
-        
-        # Check if end time is actually next day (e.g., 12:30 AM is before 12:00 PM)
-        is_next_day = end_time < start_time
-        
-        # Generate 30-minute slots
-        slots = []
-        current = datetime.combine(datetime.today(), start_time)
-        end_full = datetime.combine(datetime.today(), end_time)
-        
-        if is_next_day:
-            end_full += timedelta(days=1)
-        
-        while current <= end_full:
-            slots.append(current.strftime("%H:%M"))
-            current += timedelta(minutes=30)
-        
-        return slots
+        # End times before the start (e.g., 12:30 AM) are on the next day
+        return gen_slots(hm12_to_minutes(parts[0]), hm12_to_minutes(parts[1]))
     except Exception as e:
         print(f"Error parsing time slots '{time_str}': {e}")
         return []
 
-# Load restaurant configuration
-def load_restaurant_config():
-    """Load restaurant data including operating hours"""
-    try:
-        with open("restaurant_data.json", "r") as f:
-            restaurant_data = json.load(f)
-        return restaurant_data
-    except Exception as e:
-        print(f"Error loading restaurant_data.json: {e}")
-        return None
-
-restaurant_data = load_restaurant_config()
-operating_hours = restaurant_data.get("operating_hours", {}) if restaurant_data else {}
+# Restaurant configuration is loaded once in config.py
+operating_hours = RESTAURANT_DATA.get("operating_hours", {})
 
 # Parse operating hours from restaurant data
 WEEKDAY_HOURS = operating_hours.get("weekdays", "12:00 PM - 11:30 PM")
@@ -80,6 +70,10 @@ if not WEEKEND_SLOTS:
     WEEKEND_SLOTS = WEEKDAY_SLOTS
     print(f"⚠️  Using weekday slots for weekends")
 
+# Slot lists are fixed from here on
+WEEKDAY_SLOTS = tuple(WEEKDAY_SLOTS)
+WEEKEND_SLOTS = tuple(WEEKEND_SLOTS)
+
 # Table covers available
 COVERS = [1, 2, 3, 4, 5, 6, 8, 9, 10]
 
@@ -96,76 +90,95 @@ TABLE_INVENTORY = {
     10: 8
 }
 
+# Per-slot table counts keyed by str(covers), computed once and shared by every seeded document
+COVER_CAPACITY = {str(covers): TABLE_INVENTORY.get(covers, 1) for covers in COVERS}
+
 # Days to exclude (restaurant closed) - empty means open all days
 CLOSED_DAYS = []
 
+# Documents per insert_many round-trip
+SEED_BATCH_SIZE = 10000
+
+# Indexes from earlier schema versions (one document per cover size), superseded by slot_time_key
+LEGACY_AVAILABILITY_INDEXES = ["date_1_time_1_covers_1", "date_1_is_available_1", "store_id_1_date_1"]
+
 def seed_availability():
     """Populate MongoDB with a full year of availability slots based on restaurant hours"""
     try:
-        availability_col = get_availability_collection()
-        
-        # Clear existing data
-        availability_col.delete_many({"store_id": STORE_ID})
-        request_logger.info(f"Cleared existing availability data for store {STORE_ID}")
+        # Raw handle: old-schema documents must go before the unique slot index can be built
+        availability_col = get_mongo_client(None)[MONGO_DB][MONGO_AVAILABILITY_COLLECTION]
+        for index_name in LEGACY_AVAILABILITY_INDEXES:
+            try:
+                availability_col.drop_index(index_name)
+            except OperationFailure:
+                pass  # Index does not exist
+        
+        # Clear only old-schema data (one document per cover size); current slots are kept, so a
+        # re-run leaves existing availability (and booked-down counts) untouched
+        cleared = availability_col.delete_many({"store_id": STORE_ID, "available": {"$exists": False}})
+        request_logger.info(f"Cleared {cleared.deleted_count} old-schema availability documents for store {STORE_ID}")
+        
+        # Create indexes before the bulk load; the unique slot index makes the upserts idempotent
+        ensure_availability_indexes(availability_col)
         
         # Generate dates for the entire year 2026
         start_date = datetime(2026, 1, 1, tzinfo=IST)
         end_date = datetime(2026, 12, 31, tzinfo=IST)
         
-        current_date = start_date
+        # Open days as (date_str, is_weekend) pairs; weekdays are 0-4, weekends 5-6
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        date_infos = [(day.strftime("%Y-%m-%d"), day.weekday() >= 5) for day in days if day.weekday() not in CLOSED_DAYS]
+        weekend_count = sum(1 for _, is_weekend in date_infos if is_weekend)
+        weekday_count = len(date_infos) - weekend_count
+        
+        created_at = datetime.now(IST).isoformat()
+        
+        # One document per (date, time), all cover sizes inside; generated lazily and
+        # upserted SEED_BATCH_SIZE at a time, inserting only slots that do not exist yet
+        # 'available' tracks the number of TABLES left per party size, keyed by str(covers)
+        # and decremented by 1 per booking in reservation_db.py
+        slot_docs = (
+            {
+                "date": date_str,
+                "time": time_slot,
+                "store_id": STORE_ID,
+                "available": COVER_CAPACITY,
+                "max_capacity": COVER_CAPACITY,
+                "day_type": "weekend" if is_weekend else "weekday",
+                "created_at": created_at
+            }
+            for date_str, is_weekend in date_infos
+            for time_slot in (WEEKEND_SLOTS if is_weekend else WEEKDAY_SLOTS)
+        )
+        
+        # Seed data is reproducible, so bulk inserts skip waiting on the journal; index builds
+        # and the reservation collection keep the default write concern
+        seed_col = availability_col.with_options(write_concern=WriteConcern(w=1, j=False))
+        
         slots_created = 0
-        weekday_count = 0
-        weekend_count = 0
-        
-        while current_date <= end_date:
-            # Skip closed days (e.g., Mondays)
-            if current_date.weekday() not in CLOSED_DAYS:
-                date_str = current_date.strftime("%Y-%m-%d")
-                
-                # Determine if weekday (0-4) or weekend (5-6)
-                is_weekend = current_date.weekday() >= 5
-                time_slots = WEEKEND_SLOTS if is_weekend else WEEKDAY_SLOTS
-                
-                # Add slots based on operating hours
-                for time_slot in time_slots:
-                    for covers in COVERS:
-                        slot_doc = {
-                            "date": date_str,
-                            "time": time_slot,
-                            "covers": covers,
-                            "store_id": STORE_ID,
-                            "is_available": True,
-                            # 'available_tables' tracks the number of TABLES available for this specific party size ('covers')
-                            # Decremented by 1 per booking in reservation_db.py
-                            "available_tables": TABLE_INVENTORY.get(covers, 1),
-                            "max_capacity": TABLE_INVENTORY.get(covers, 1),
-                            "day_type": "weekend" if is_weekend else "weekday",
-                            "created_at": datetime.now(IST).isoformat()
-                        }
-                        availability_col.insert_one(slot_doc)
-                        slots_created += 1
-                
-                if is_weekend:
-                    weekend_count += 1
-                else:
-                    weekday_count += 1
-            
-            # Move to next day
-
-            current_date += timedelta(days=1)
-        
-        # Create indices for better performance
-        availability_col.create_index([("date", 1), ("time", 1), ("covers", 1)])
-        availability_col.create_index([("date", 1), ("is_available", 1)])
-        availability_col.create_index([("store_id", 1), ("date", 1)])
+        slots_existing = 0
+        while batch := list(islice(slot_docs, SEED_BATCH_SIZE)):
+            result = seed_col.bulk_write(
+                [
+                    UpdateOne(
+                        {"store_id": STORE_ID, "date": slot_doc["date"], "time": slot_doc["time"]},
+                        {"$setOnInsert": slot_doc},
+                        upsert=True
+                    )
+                    for slot_doc in batch
+                ],
+                ordered=False
+            )
+            slots_created += result.upserted_count
+            slots_existing += len(batch) - result.upserted_count
         
         request_logger.info(f"Successfully seeded {slots_created} availability slots for year 2026")
-        print(f"✓ Successfully created {slots_created} availability slots for the entire year 2026")
+        print(f"✓ Successfully created {slots_created} availability slots for the entire year 2026 ({slots_existing} already existed)")
         print(f"  - Operating Hours (from restaurant_data.json):")
         print(f"    Weekdays: {WEEKDAY_HOURS}")
         print(f"    Weekends: {WEEKEND_HOURS}")
-        print(f"  - Weekday slots: {len(WEEKDAY_SLOTS)} times/day × {len(COVERS)} covers × {weekday_count} days")
-        print(f"  - Weekend slots: {len(WEEKEND_SLOTS)} times/day × {len(COVERS)} covers × {weekend_count} days")
+        print(f"  - Weekday slots: {len(WEEKDAY_SLOTS)} times/day × {weekday_count} days")
+        print(f"  - Weekend slots: {len(WEEKEND_SLOTS)} times/day × {weekend_count} days")
         print(f"  - Cover sizes: {COVERS}")
         print(f"  - Store ID: {STORE_ID}")
         return True
@@ -178,29 +191,35 @@ def seed_availability():
 def verify_seeding():
     """Verify that the data has been properly seeded"""
     try:
-        availability_col = get_availability_collection()
-        
-        # Get stats
-        total_slots = availability_col.count_documents({"store_id": STORE_ID})
-        available_slots = availability_col.count_documents({
-            "store_id": STORE_ID,
-            "is_available": True
-        })
-        unique_dates = len(list(availability_col.distinct("date", {"store_id": STORE_ID})))
-        unique_times = len(list(availability_col.distinct("time", {"store_id": STORE_ID})))
+        availability_col = get_mongo_client(None)[MONGO_DB][MONGO_AVAILABILITY_COLLECTION]
+        
+        # Get stats and samples in a single aggregation round-trip
+        has_free_table = {"$gt": [{"$max": {"$map": {"input": {"$objectToArray": "$available"}, "in": "$$this.v"}}}, 0]}
+        stats = next(availability_col.aggregate([
+            {"$match": {"store_id": STORE_ID}},
+            {"$facet": {
+                "total": [{"$count": "n"}],
+                "available": [{"$match": {"$expr": has_free_table}}, {"$count": "n"}],
+                "dates": [{"$group": {"_id": "$date"}}, {"$count": "n"}],
+                "times": [{"$group": {"_id": "$time"}}, {"$count": "n"}],
+                "sample": [{"$limit": 5}]
+            }}
+        ]))
+        
+        def facet_count(name):
+            return stats[name][0]["n"] if stats[name] else 0
         
         print(f"\n📊 Seeding Verification:")
-        print(f"  Total slots: {total_slots}")
-        print(f"  Available slots: {available_slots}")
-        print(f"  Unique dates: {unique_dates}")
-        print(f"  Unique time slots: {unique_times}")
+        print(f"  Total slots: {facet_count('total')}")
+        print(f"  Available slots: {facet_count('available')}")
+        print(f"  Unique dates: {facet_count('dates')}")
+        print(f"  Unique time slots: {facet_count('times')}")
         
         # Show sample slots
-        sample_slots = list(availability_col.find({"store_id": STORE_ID}).limit(5))
         print(f"\n📋 Sample slots:")
-        for slot in sample_slots:
+        for slot in stats["sample"]:
             day_type = slot.get('day_type', 'unknown')
-            print(f"  - {slot['date']} at {slot['time']} for {slot['covers']} covers ({day_type})")
+            print(f"  - {slot['date']} at {slot['time']} tables by covers {slot.get('available', {})} ({day_type})")
         
         return True
         